@@ -1,23 +1,52 @@
 import os
 import csv
 import subprocess
+import sys
+import time
 from datetime import datetime
 import logging
+import logging.handlers
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 
-def setup_logging(log_file: str) -> None:
-    """Initialize logging configuration."""
+# Keywords in gh output that mark a migration as failed
+ERROR_PATTERN = re.compile(r"error|failed", re.IGNORECASE)
+
+# Stops the writer thread
+RESULTS_DONE = object()
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+def setup_logging() -> None:
+    """Initialize console logging configuration."""
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(message)s',
+        format=LOG_FORMAT,
         handlers=[
-            logging.FileHandler(log_file),
             logging.StreamHandler()
         ]
     )
 
+def add_log_file(log_file: str, buffer_capacity: int = 100) -> None:
+    """Add a buffered handler that appends log records to log_file."""
+    root = logging.getLogger()
+    log_path = os.path.abspath(log_file)
+    for handler in root.handlers:
+        target = getattr(handler, 'target', None)
+        if isinstance(target, logging.FileHandler) and target.baseFilename == log_path:
+            return
+    
+    file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(logging.handlers.MemoryHandler(
+        buffer_capacity, flushLevel=logging.ERROR, target=file_handler
+    ))
+
 def create_directory(path: str) -> None:
     """Create directory if it doesn't exist."""
     Path(path).mkdir(exist_ok=True)
@@ -32,59 +61,146 @@ def validate_env_vars() -> bool:
         return False
     return True
 
+def read_worker_count(default: int) -> Optional[int]:
+    """Read the number of concurrent migrations from MIGRATION_WORKERS."""
+    value = os.getenv('MIGRATION_WORKERS') or str(default)
+    try:
+        workers = int(value)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        logging.error(f"MIGRATION_WORKERS must be a positive integer, got '{value}'")
+        return None
+    return workers
+
 def initialize_csv_output(output_file: str) -> None:
     """Initialize the output CSV file with headers."""
     if not Path(output_file).exists():
         headers = ['SourceOrg', 'SourceRepo', 'TargetOrg', 'TargetRepo', 
                   'Status', 'StartTime', 'EndTime', 'TimeTakenSeconds', 'TimeTakenMinutes']
-        with open(output_file, 'w', newline='') as f:
+        with open(output_file, 'w', newline='', encoding='utf-8') as f:
             csv.writer(f).writerow(headers)
 
-def migrate_repository(current_name: str, new_name: str, logs_folder: str, output_csv: str) -> None:
-    """Migrate a single repository and log the results."""
+def read_repository_pairs(repos_csv: str) -> Optional[Tuple[List[Tuple[str, str]], int]]:
+    """Read repository name pairs and the count of incomplete rows from the CSV."""
+    pairs = []
+    skipped = 0
+    with open(repos_csv, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader, [])]
+        try:
+            current_index = header.index('CURRENT-NAME')
+            new_index = header.index('NEW-NAME')
+        except ValueError:
+            logging.error(f"CSV file {repos_csv} must have columns: CURRENT-NAME, NEW-NAME")
+            return None
+        
+        for row in reader:
+            if not row:
+                continue
+            current_name = row[current_index].strip() if current_index < len(row) else ''
+            new_name = row[new_index].strip() if new_index < len(row) else ''
+            if current_name and new_name:
+                pairs.append((current_name, new_name))
+            else:
+                skipped += 1
+    
+    return pairs, skipped
+
+def read_completed_migrations(output_csv: str) -> Set[Tuple[str, str, str, str]]:
+    """Return the repositories already migrated successfully according to the output CSV."""
+    if not Path(output_csv).exists():
+        return set()
+    with open(output_csv, 'r', newline='', encoding='utf-8') as f:
+        return {
+            (row['SourceOrg'], row['SourceRepo'], row['TargetOrg'], row['TargetRepo'])
+            for row in csv.DictReader(f)
+            if row.get('Status') == 'Success'
+        }
+
+def migrate_repository(current_name: str, new_name: str, source: str, destination: str,
+                       logs_dir: Path, result_queue: queue.Queue, writer_failed: threading.Event) -> None:
+    """Migrate a single repository and queue its results for the writer thread."""
+    if writer_failed.is_set():
+        return
+    logging.info(f"Migrating '{current_name}' -> '{new_name}'...")
     start_time = datetime.now()
+    start_clock = time.monotonic()
     status = "Success"
     
-    command = f"gh gei migrate-repo --github-source-org {os.getenv('SOURCE')} " \
-              f"--source-repo {current_name} --github-target-org {os.getenv('DESTINATION')} " \
-              f"--target-repo {new_name}"
+    command = [
+        "gh", "gei", "migrate-repo",
+        "--github-source-org", source,
+        "--source-repo", current_name,
+        "--github-target-org", destination,
+        "--target-repo", new_name
+    ]
     
     try:
-        output = subprocess.run(command, shell=True, capture_output=True, text=True)
+        result = subprocess.run(command, capture_output=True, text=True, check=False)
         
-        if output.returncode != 0 or 'error' in output.stdout.lower() or 'failed' in output.stdout.lower():
+        if (result.returncode != 0 or ERROR_PATTERN.search(result.stdout)
+                or ERROR_PATTERN.search(result.stderr)):
             status = "Failed"
-            repo_log_file = Path(logs_folder) / f"{current_name}.log"
-            with open(repo_log_file, 'w') as f:
-                f.write(output.stdout + output.stderr)
-            logging.error(f"Error log saved to {repo_log_file}")
-        
-        logging.info(f"Command output for '{current_name}': {output.stdout}")
+            output = result.stdout + result.stderr
+            result_queue.put(('failure', logs_dir / f"{current_name}.log",
+                              output.encode('utf-8', 'replace')))
+            logging.error(f"Command output for '{current_name}':\n{output.rstrip()}")
         
     except Exception as e:
         status = "Failed"
-        repo_log_file = Path(logs_folder) / f"{current_name}.log"
-        with open(repo_log_file, 'w') as f:
-            f.write(str(e))
-        logging.error(f"Exception caught during migration of '{current_name}'. See {repo_log_file} for details.")
+        result_queue.put(('failure', logs_dir / f"{current_name}.log",
+                          str(e).encode('utf-8', 'replace')))
+        logging.error(f"Exception caught during migration of '{current_name}': {e}")
     
+    time_taken = time.monotonic() - start_clock
     end_time = datetime.now()
-    time_taken = (end_time - start_time).total_seconds()
-      # Write migration details to CSV
-    with open(output_csv, 'a', newline='') as f:
-        csv.writer(f).writerow([
-            os.getenv('SOURCE'),
-            current_name,
-            os.getenv('DESTINATION'),
-            new_name,
-            status,
-            start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time.strftime("%Y-%m-%d %H:%M:%S"),
-            f"{time_taken:.2f}",
-            f"{(time_taken / 60):.2f}"
-        ])
-    
-    logging.info(f"Migration result: Status={status}, Duration={time_taken:.2f}s")
+    logging.info(f"Migration result for '{current_name}': Status={status}, Duration={time_taken:.2f}s")
+    
+    result_queue.put(('csv', (
+        source,
+        current_name,
+        destination,
+        new_name,
+        status,
+        start_time.isoformat(sep=' ', timespec='seconds'),
+        end_time.isoformat(sep=' ', timespec='seconds'),
+        f"{time_taken:.2f}",
+        f"{(time_taken / 60):.2f}"
+    )))
+
+def write_results(result_queue: queue.Queue, output_csv: str, writer_failed: threading.Event,
+                  batch_size: int = 50) -> None:
+    """Write queued CSV rows and error logs until RESULTS_DONE arrives."""
+    batch = []
+    try:
+        with open(output_csv, 'a', newline='', encoding='utf-8', buffering=1 << 16) as f:
+            writer = csv.writer(f)
+            while (message := result_queue.get()) is not RESULTS_DONE:
+                if message[0] == 'failure':
+                    _, repo_log_file, contents = message
+                    try:
+                        repo_log_file.write_bytes(contents)
+                        logging.error(f"Error log saved to {repo_log_file}")
+                    except OSError as e:
+                        logging.error(f"Could not write error log {repo_log_file}: {e}")
+                else:
+                    batch.append(message[1])
+                if batch and (len(batch) >= batch_size or result_queue.empty()):
+                    writer.writerows(batch)
+                    f.flush()
+                    batch.clear()
+            writer.writerows(batch)
+    except Exception:
+        writer_failed.set()
+        logging.exception(f"Could not write migration results to {output_csv}")
+        # Report rows that were queued but never written
+        unrecorded = list(batch)
+        while (message := result_queue.get()) is not RESULTS_DONE:
+            if message[0] == 'csv':
+                unrecorded.append(message[1])
+        for row in unrecorded:
+            logging.error(f"Result not recorded: {row[1]} -> {row[3]} Status={row[4]}")
 
 def main():
     # Initialize constants
@@ -93,46 +209,96 @@ def main():
     LOGS_FOLDER = "logs"
     ENV_FILE = ".env"
     REPOS_CSV = "repos.csv"
+    DEFAULT_WORKERS = 4
     
-    # Setup logging and create necessary directories
-    setup_logging(LOG_FILE)
-    create_directory(LOGS_FOLDER)
-    
-    logging.info("Starting GitHub repository migration script...")
+    # Validate inputs
+    setup_logging()
     
-    # Load environment variables
-    if Path(ENV_FILE).exists():
-        load_dotenv(ENV_FILE)
-        logging.info(f"Loaded environment variables from {ENV_FILE}")
-    else:
+    if not Path(ENV_FILE).exists():
         logging.error(f"{ENV_FILE} file not found.")
-        return
+        sys.exit(1)
+    load_dotenv(ENV_FILE)
     
-    # Validate environment variables
     if not validate_env_vars():
-        return
+        sys.exit(1)
     
-    # Check for repos.csv
     if not Path(REPOS_CSV).exists():
         logging.error(f"CSV file {REPOS_CSV} not found. Please create with columns: CURRENT-NAME, NEW-NAME")
-        return
+        sys.exit(1)
+    
+    # Collect repositories to migrate
+    result = read_repository_pairs(REPOS_CSV)
+    if result is None:
+        sys.exit(1)
+    pairs, skipped = result
+    
+    max_workers = read_worker_count(DEFAULT_WORKERS)
+    if max_workers is None:
+        sys.exit(1)
+    
+    source = os.environ['SOURCE']
+    destination = os.environ['DESTINATION']
+    
+    # Setup log file and create necessary directories
+    add_log_file(LOG_FILE)
+    create_directory(LOGS_FOLDER)
+    
+    logging.info("Starting GitHub repository migration script...")
+    logging.info(f"Loaded environment variables from {ENV_FILE}")
+    if skipped:
+        logging.error(f"Skipped {skipped} CSV rows missing CURRENT-NAME or NEW-NAME.")
     
     # Initialize output CSV
     initialize_csv_output(OUTPUT_CSV)
     
+    # Skip repositories already migrated
+    completed = read_completed_migrations(OUTPUT_CSV)
+    if completed:
+        remaining = [(current_name, new_name) for current_name, new_name in pairs
+                     if (source, current_name, destination, new_name) not in completed]
+        if len(remaining) < len(pairs):
+            logging.info(f"Skipping {len(pairs) - len(remaining)} repositories already migrated "
+                         f"according to {OUTPUT_CSV}")
+        pairs = remaining
+    
+    logs_dir = Path(LOGS_FOLDER)
+    
+    logging.info(f"Migrating {len(pairs)} repositories with {max_workers} workers")
+    
     # Process repositories
-    with open(REPOS_CSV, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            current_name = row.get('CURRENT-NAME')
-            new_name = row.get('NEW-NAME')
-            
-            if not current_name or not new_name:
-                logging.error("Missing CURRENT-NAME or NEW-NAME in CSV row. Skipping.")
-                continue
-            
-            logging.info(f"Migrating '{current_name}' -> '{new_name}'...")
-            migrate_repository(current_name, new_name, LOGS_FOLDER, OUTPUT_CSV)
+    result_queue = queue.Queue()
+    writer_failed = threading.Event()
+    writer_thread = threading.Thread(target=write_results, args=(result_queue, OUTPUT_CSV, writer_failed),
+                                     daemon=True)
+    writer_thread.start()
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
+    try:
+        for current_name, new_name in pairs:
+            futures.append(executor.submit(migrate_repository, current_name, new_name,
+                                           source, destination, logs_dir, result_queue, writer_failed))
+        executor.shutdown(wait=True)
+    except BaseException:
+        logging.error("Interrupted. Cancelling pending migrations and waiting for running ones to finish...")
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+    finally:
+        result_queue.put(RESULTS_DONE)
+        writer_thread.join()
+    
+    unexpected_errors = 0
+    for (current_name, _), future in zip(pairs, futures):
+        if not future.cancelled() and future.exception() is not None:
+            unexpected_errors += 1
+            logging.error(f"Unexpected error while migrating '{current_name}'", exc_info=future.exception())
+    
+    if writer_failed.is_set():
+        logging.error(f"Stopped migrating because results could not be written to {OUTPUT_CSV}")
+    if unexpected_errors or writer_failed.is_set():
+        sys.exit(1)
     
     logging.info("All repository migrations complete!")
 